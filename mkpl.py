@@ -24,55 +24,70 @@
 
 # region imports
 import argparse
-import os.path
+import os
 import re
-from filecmp import cmp
-from os.path import basename, dirname, exists, getctime, getsize, isdir, join, normpath
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+from hashlib import blake2b
+from itertools import islice, repeat
+from operator import itemgetter
+from os.path import (
+    basename,
+    dirname,
+    exists,
+    getsize,
+    isdir,
+    isfile,
+    join,
+    normpath,
+    realpath,
+)
 from pathlib import Path
-from random import shuffle
-from re import sub
 from string import capwords
-
-from mutagen import File, MutagenError, id3
-from tempcache import TempCache
+from threading import Lock
 
 # endregion
 
 # region globals
-AUDIO_FORMAT = {
-    "mp1",
-    "mp2",
-    "mp3",
-    "aac",
-    "ogg",
-    "wav",
-    "wma",
-    "m4a",
-    "aiff",
-    "flac",
-    "alac",
-    "opus",
-    "ape",
-    "webm",
-}
-VIDEO_FORMAT = {
-    "mp4",
-    "avi",
-    "xvid",
-    "divx",
-    "mkv",
-    "mpeg",
-    "mpg",
-    "mov",
-    "wmv",
-    "flv",
-    "vob",
-    "asf",
-    "m4v",
-    "3gp",
-    "f4a",
-}
+AUDIO_FORMAT = frozenset(
+    {
+        "mp1",
+        "mp2",
+        "mp3",
+        "aac",
+        "ogg",
+        "wav",
+        "wma",
+        "m4a",
+        "aiff",
+        "flac",
+        "alac",
+        "opus",
+        "ape",
+        "webm",
+    }
+)
+VIDEO_FORMAT = frozenset(
+    {
+        "mp4",
+        "avi",
+        "xvid",
+        "divx",
+        "mkv",
+        "mpeg",
+        "mpg",
+        "mov",
+        "wmv",
+        "flv",
+        "vob",
+        "asf",
+        "m4v",
+        "3gp",
+        "f4a",
+    }
+)
 FILE_FORMAT = AUDIO_FORMAT.union(VIDEO_FORMAT)
+PRINT_LOCK = Lock()
 __version__ = "1.11.0"
 
 
@@ -83,8 +98,6 @@ __version__ = "1.11.0"
 def get_args():
     """Get command-line arguments"""
 
-    global FILE_FORMAT
-
     parser = argparse.ArgumentParser(
         description="Command line tool to creates playlist file in M3U format.",
         epilog="See latest release from https://github.com/MatteoGuadrini/mkpl",
@@ -279,27 +292,22 @@ def get_args():
     args.enabled_extensions = False
     args.enabled_title = False
     args.enabled_encoding = False
-    # Verify extension attribute in append mode
-    if args.append:
-        with open(args.playlist, mode=args.open_mode) as opened_playlist:
-            opened_playlist.seek(0)
-            first_three_lines = opened_playlist.readlines(100)
-            for line in first_three_lines:
-                if "#EXTM3U" in line:
-                    args.enabled_extensions = True
-                if "#PLAYLIST" in line:
-                    args.enabled_title = True
-                if "#EXTENC" in line:
-                    args.enabled_encoding = True
-            # Check if extensions are disabled and image is specified
-            if getsize(args.playlist) > 0:
-                if not args.enabled_extensions and args.image:
-                    print(
-                        f"warning: image {args.image} has not "
-                        "been set because the extension flag"
-                        " is not present in the playlist"
-                    )
-                    args.image = None
+    # Verify extension attribute in append mode, on a non-empty playlist
+    if args.append and isfile(args.playlist) and getsize(args.playlist) > 0:
+        with open(args.playlist, "rb") as opened_playlist:
+            # Extension tags are at the beginning of the playlist
+            head = opened_playlist.read(4096)
+        args.enabled_extensions = b"#EXTM3U" in head
+        args.enabled_title = b"#PLAYLIST" in head
+        args.enabled_encoding = b"#EXTENC" in head
+        # Check if extensions are disabled and image is specified
+        if not args.enabled_extensions and args.image:
+            print(
+                f"warning: image {args.image} has not "
+                "been set because the extension flag"
+                " is not present in the playlist"
+            )
+            args.image = None
 
     # Check if image file exists
     if args.image:
@@ -307,16 +315,27 @@ def get_args():
             parser.error(f"image file {args.image} does not exist")
 
     # Extend files format
+    file_formats = set(FILE_FORMAT)
     if args.include:
-        FILE_FORMAT.update(set([fmt.strip("*").strip(".") for fmt in args.include]))
+        file_formats.update(fmt.strip("*").strip(".").lower() for fmt in args.include)
 
     # Select only one format
     if args.format:
-        FILE_FORMAT = {args.format.strip("*").strip(".")}
+        file_formats = {args.format.strip("*").strip(".")}
+
+    # Freeze files format: they are read-only from now on
+    args.file_formats = frozenset(file_formats)
+
+    # Check maximum number of tracks
+    if args.max_tracks is not None and args.max_tracks < 1:
+        parser.error(f"max tracks {args.max_tracks} must be at least 1")
 
     # Convert size string into number
     if args.size:
-        args.size = human_size_to_byte(args.size)
+        try:
+            args.size = human_size_to_byte(args.size)
+        except ValueError as err:
+            parser.error(f"invalid size {args.size}: {err}")
 
     # Check link argument if it is a valid link
     if args.link:
@@ -336,11 +355,17 @@ def human_size_to_byte(size):
     :return: int
     """
     size_name = ("b", "kb", "mb", "gb", "tb", "pb", "eb", "zb", "yb")
-    size_parts = re.search("([0-9]+) ?([a-zA-Z]+)?", size)
-    num, unit = int(size_parts[1]), size_parts[2]
+    # Split number and unit
+    size = size.strip()
+    unit = size.lstrip("0123456789")
+    number = size[: len(size) - len(unit)]
+    if not number:
+        raise ValueError(f"size {size} does not start with a number")
+    num, unit = int(number), unit.strip().lower()
     if unit:
-        unit = unit.lower()
         unit = unit if "b" in unit else unit + "b"
+        if unit not in size_name:
+            raise ValueError(f"size unit {unit} is not one of {size_name}")
         idx = size_name.index(unit)
         factor = 1024**idx
         size_bytes = num * factor
@@ -357,34 +382,79 @@ def confirm(file, default="y"):
     :return: True if the answer is Y.
     :rtype: bool
     """
-    while (
-        answer := input(
-            "Add file {0} to playlist? {1}:".format(
-                file, "[Y/n]" if default == "y" else "[y/N]"
-            )
-        ).lower()
-    ) not in ("y", "n"):
-        # Check if default
-        if not answer:
-            answer = default
-            break
+    prompt = "Add file {0} to playlist? {1}:".format(
+        file, "[Y/n]" if default == "y" else "[y/N]"
+    )
+    try:
+        while (answer := input(prompt).lower()) not in ("y", "n"):
+            # Check if default
+            if not answer:
+                answer = default
+                break
+    except EOFError:
+        # Piped answers are over: use default for the remaining files
+        answer = default
     return answer == "y"
 
 
-def file_in_playlist(playlist, file, root=None):
-    """Check if file is in the playlist"""
-    for f in playlist:
-        # Skip extended tags
-        if f.startswith("#"):
-            continue
-        # Check if absolute path in playlist
-        if root:
-            f = join(root, f)
-        # Make standard the path
-        f = unix_to_dos(f, viceversa=True)
-        # Compare two files
-        if cmp(f, file):
+def file_fingerprint(path, size, window=1 << 16):
+    """Make a fingerprint of a file from its beginning, middle and end
+
+    :param path: file path
+    :param size: file size in bytes
+    :param window: bytes read in each part of the file
+    :return: bytes
+    """
+    digest = blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        for offset in sorted({0, max(0, (size - window) // 2), max(0, size - window)}):
+            file.seek(offset)
+            digest.update(file.read(window))
+    return digest.digest()
+
+
+def file_is_duplicate(path, size, files_by_size):
+    """Check if a file with the same content has already been seen
+
+    :param path: file path
+    :param size: file size in bytes
+    :param files_by_size: dictionary of size and list of [path, fingerprint]
+    :return: True if the same content is in files_by_size, else add file.
+    :rtype: bool
+    """
+    from filecmp import cmp
+
+    same_size = files_by_size.setdefault(size, [])
+    # Read files only when there are others with the same size
+    fingerprint = file_fingerprint(path, size) if same_size else None
+    for other in same_size:
+        if other[1] is None:
+            other[1] = file_fingerprint(other[0], size)
+        if other[1] == fingerprint and cmp(other[0], path, shallow=False):
             return True
+    same_size.append([path, fingerprint])
+    return False
+
+
+def file_is_unique(path, seen, files_by_size, stat=None):
+    """Check if a file is not the same, or a copy, of one already seen
+
+    :param path: file path
+    :param seen: set of (device, inode) of files already seen
+    :param files_by_size: dictionary of size and list of [path, fingerprint]
+    :param stat: stat result of the file, if already read
+    :return: True if the file is unique, then add it to the seen files.
+    :rtype: bool
+    """
+    # On Windows, DirEntry.stat() does not fill device and inode
+    if stat is None or not stat.st_ino:
+        stat = os.stat(path)
+    file_id = (stat.st_dev, stat.st_ino)
+    if file_id in seen:
+        return False
+    seen.add(file_id)
+    # Check copies of the same file
+    return not file_is_duplicate(path, stat.st_size, files_by_size)
 
 
 def join_playlist(playlist, *others):
@@ -392,10 +462,12 @@ def join_playlist(playlist, *others):
     for file in others:
         try:
             # open playlist, remove extensions and extend current playlist file
-            lines = open(file).readlines()
-            playlist.extend(
-                [line.rstrip() for line in lines if not line.startswith("#")]
-            )
+            with open(file, errors="ignore") as opened_playlist:
+                playlist.extend(
+                    line.rstrip()
+                    for line in opened_playlist
+                    if not line.startswith("#")
+                )
         except FileNotFoundError:
             print(f"warning: {file} file not found")
         except OSError as err:
@@ -436,14 +508,9 @@ def url_chars(playlist):
         "}": "%7D",
         "~": "%7E",
     }
-    ret = []
-    for file in playlist:
-        for char in file:
-            if URL_CHARS.get(char):
-                file = file.replace(char, URL_CHARS.get(char))
-        ret.append(file)
-
-    return ret
+    # Translate all chars in a single pass for each file
+    table = str.maketrans(URL_CHARS)
+    return [file.translate(table) for file in playlist]
 
 
 def report_issue(exc):
@@ -461,67 +528,135 @@ def open_multimedia_file(path):
 
     :param path: multimedia file to open
     """
+    from mutagen import File, MutagenError
+
     try:
-        file = File(path)
+        # Check mp3 file: parse only the text frames used, not cover art
+        if path.lower().endswith(".mp3"):
+            from mutagen.id3 import Frames, Frames_2_2
+            from mutagen.mp3 import MP3
+
+            # ID3v2.2 tags use three-character names for the same frames
+            known_frames = {
+                frame: Frames[frame]
+                for frame in ("TALB", "TIT2", "TDOR", "TORY", "TRCK")
+            }
+            known_frames.update(
+                (frame, Frames_2_2[frame]) for frame in ("TAL", "TT2", "TOR", "TRK")
+            )
+            file = MP3(path, known_frames=known_frames)
+        else:
+            file = File(path)
     except MutagenError:
-        print(f"warning: file '{path}' loading failed")
+        wprint(f"file '{path}' loading failed")
         return False
     return file
 
 
-def get_track(file):
+def read_tags(path, tags=None):
+    """Read the tags used for patterns and sort, once for each file
+
+    :param path: multimedia file path
+    :param tags: dictionary of path and tags already read
+    :return: dict
+    """
+    # Check if file has already been read
+    if tags is not None and path in tags:
+        return tags[path]
+    from mutagen import id3
+
+    file = open_multimedia_file(path)
+    info = getattr(file, "info", None)
+    file_tags = {"length": getattr(info, "length", 0.0)}
+    # Keep only small values, not the file with its pictures
+    id3_tags = getattr(file, "tags", None)
+    if isinstance(id3_tags, id3.ID3Tags):
+        for tag in ("TIT2", "TALB", "TRCK", "TDOR"):
+            if id3_tags.get(tag):
+                file_tags[tag] = str(id3_tags[tag][0])
+    if tags is not None:
+        tags[path] = file_tags
+    return file_tags
+
+
+def get_track(file, tags=None):
     """Get file by track for sort"""
-    file = open_multimedia_file(file)
-    if file and hasattr(file, "tags"):
-        default = id3.TRCK(text="0")
-        return int(file.tags.get("TRCK", default)[0])
+    # Files without tags, or not loaded, go first
+    return int(read_tags(file, tags).get("TRCK", "0"))
 
 
-def get_year(file):
+def get_year(file, tags=None):
     """Get file by year for sort"""
-    file = open_multimedia_file(file)
-    if file and hasattr(file, "tags"):
-        default = id3.TDOR(text="0")
-        return file.tags.get("TDOR", default)[0]
+    # Files without tags, or not loaded, go first
+    return read_tags(file, tags).get("TDOR", "0")
 
 
-def get_length(file):
+def get_length(file, tags=None):
     """Get file by length for sort"""
-    file = open_multimedia_file(file)
-    if file and hasattr(file, "info"):
-        return file.info.length if hasattr(file.info, "length") else 0.0
+    return read_tags(file, tags)["length"]
 
 
-def find_pattern(pattern, path):
-    """Find patter in a file and tags"""
-    global AUDIO_FORMAT
+def sort_by_tag(files, key, max_workers=None):
+    """Sort files by a tag, reading files in parallel
+
+    :param files: multimedia file paths
+    :param key: function that gets the tag of a file
+    :param max_workers: maximum number of threads that read files
+    :return: list
+    """
+    with ThreadPoolExecutor(max_workers) as executor:
+        keys = list(executor.map(key, files))
+    return [file for _, file in sorted(zip(keys, files), key=itemgetter(0))]
+
 
+def find_pattern(pattern, path, tags=None):
+    """Find patter in a file and tags"""
     # Create compiled pattern
     if not isinstance(pattern, re.Pattern):
         pattern = re.compile(pattern)
     # Check pattern into filename
-    if pattern.findall(path):
+    if pattern.search(path):
         return True
     # Check type of file
-    ext = os.path.splitext(path)[1].replace(".", "").lower()
+    ext = path.rpartition(".")[2].lower()
     if ext in AUDIO_FORMAT:
-        file = open_multimedia_file(path)
-        # Check supports of ID3 tags add compiled pattern
-        if file and hasattr(file, "ID3"):
-            # Check pattern into title
-            if file.tags.get("TIT2"):
-                if pattern.findall(file.tags.get("TIT2")[0]):
-                    return True
-            # Check pattern into album
-            if file.tags.get("TALB"):
-                if pattern.findall(file.tags.get("TALB")[0]):
-                    return True
+        file_tags = read_tags(path, tags)
+        # Check pattern into title and album
+        for tag in ("TIT2", "TALB"):
+            if tag in file_tags and pattern.search(file_tags[tag]):
+                return True
+    return False
+
+
+def file_match(path, pattern=None, exclude_pattern=None, tags=None):
+    """Check if file matches inclusion pattern and not exclusion pattern
+
+    :param path: multimedia file path
+    :param pattern: inclusion pattern
+    :param exclude_pattern: exclusion pattern
+    :param tags: dictionary of path and tags already read
+    :return: bool
+    """
+    if pattern and not find_pattern(pattern, path, tags):
+        return False
+    if exclude_pattern and find_pattern(exclude_pattern, path, tags):
+        return False
+    return True
 
 
 def vprint(verbose, *messages):
     """Verbose print"""
     if verbose:
-        print("debug:", *messages)
+        # Print whole lines, also from directories scanned in parallel
+        with PRINT_LOCK:
+            print("debug:", *messages)
+
+
+def wprint(*messages):
+    """Warning print"""
+    # Print whole lines, also from threads that read files
+    with PRINT_LOCK:
+        print("warning:", *messages)
 
 
 def unix_to_dos(path, viceversa=False):
@@ -531,12 +666,8 @@ def unix_to_dos(path, viceversa=False):
     :param viceversa: dos to unix
     """
     if viceversa:
-        old_sep = r"\\"
-        new_sep = "/"
-    else:
-        old_sep = "/"
-        new_sep = r"\\"
-    return sub(old_sep, new_sep, path)
+        return path.replace("\\", "/")
+    return path.replace("/", "\\")
 
 
 def write_playlist(
@@ -546,7 +677,7 @@ def write_playlist(
     encoding,
     enabled_extensions=False,
     image=None,
-    ext_part=None,
+    header=None,
     max_tracks=None,
     verbose=False,
 ):
@@ -557,6 +688,7 @@ def write_playlist(
             mode=open_mode,
             encoding="UTF-8" if encoding == "UNICODE" else encoding,
             errors="ignore",
+            buffering=1 << 20,
         ) as pl:
             if image and enabled_extensions:
                 vprint(verbose, f"set image {image}")
@@ -565,11 +697,60 @@ def write_playlist(
                 joined_string = "\n"
             end_file_string = "\n"
             # Write extensions if exists
-            if ext_part:
-                pl.write("\n".join(files[:ext_part]) + joined_string)
-            # Write all multimedia files
+            header = "\n".join(header) + joined_string if header else ""
+            # Write all multimedia files, in batches of tracks
             vprint(verbose, f"write playlist {pl.name}")
-            pl.write(joined_string.join(files[ext_part:max_tracks]) + end_file_string)
+            tracks = islice(files, max_tracks)
+            pl.write(header)
+            pl.write(next(tracks, ""))
+            while batch := list(islice(tracks, 1024)):
+                pl.write(joined_string + joined_string.join(batch))
+            pl.write(end_file_string)
+
+
+def scan_directory(
+    directory, file_formats, recursive=False, exclude_dirs=(), verbose=False
+):
+    """Scan directory once and yield multimedia files
+
+    :param directory: directory to scan
+    :param file_formats: set of file extensions, without dot
+    :param recursive: scan also subdirectories
+    :param exclude_dirs: skip directories that are or ends with these normalized paths
+    :param verbose: enable verbosity
+    :return: generator of (path, os.DirEntry) tuples
+    """
+    directories = [directory]
+    while directories:
+        current = directories.pop()
+        # Check if in exclude dirs, matching whole path components
+        if exclude_dirs:
+            absolute = os.path.abspath(current)
+            if any(
+                absolute == e_path or absolute.endswith(os.sep + e_path)
+                for e_path in exclude_dirs
+            ):
+                continue
+        # Strip "./" prefix like Path.glob does on current directory
+        strip = current == os.curdir
+        try:
+            entries = os.scandir(current)
+        except OSError as err:
+            # Skip unreadable directories and continue with the others
+            vprint(verbose, f"warning: {current} skipped: {err}")
+            continue
+        with entries:
+            for entry in entries:
+                path = entry.name if strip else entry.path
+                # Check directory, without following symlinks
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        directories.append(path)
+                    continue
+                # Check file extension and skip broken links, fifo, etc.
+                _, dot, ext = entry.name.rpartition(".")
+                if dot and ext.lower() in file_formats and entry.is_file():
+                    yield path, entry
 
 
 def make_playlist(
@@ -591,113 +772,134 @@ def make_playlist(
     windows=False,
     interactive=False,
     verbose=False,
+    max_workers=None,
 ):
     """Make playlist list"""
     filelist = list()
-    # Check if directory exists
-    if not exists(directory):
-        print(f"warning: {directory} does not exists")
-        return filelist
+    seen = set()
+    files_by_size = dict()
+    stats = dict()
+    tags = dict()
     # Check if is a directory
     if not isdir(directory):
-        print(f"warning: {directory} is not a directory")
+        if exists(directory):
+            wprint(f"{directory} is not a directory")
+        else:
+            wprint(f"{directory} does not exists")
         return filelist
-    # Build a Path object
+    # Normalize directory path once, like Path does
     path = Path(directory)
     root = path.parent
     vprint(verbose, f"current directory={path}, root={root}")
-    for fmt in file_formats:
-        # Check recursive
-        folder = "**/*" if recursive else "*"
-        files = path.glob(folder + f".{fmt}")
-        # Process found files
-        for file in files:
-            # Get size of file
-            size = file.stat().st_size
-            # Check absolute file names
-            file = str(file.resolve()) if absolute else str(file)
-            # Check file match pattern
-            if pattern:
-                # Check re pattern
-                compiled_pattern = re.compile(pattern)
-                if not find_pattern(compiled_pattern, file):
-                    continue
-            if exclude_pattern:
-                # Check re pattern
-                compiled_pattern = re.compile(exclude_pattern)
-                if find_pattern(compiled_pattern, file):
-                    continue
-            # Check if in exclude dirs
-            if any([e_path in file for e_path in exclude_dirs]):
-                continue
-            # Check if file is in playlist
-            if unique:
-                if file_in_playlist(
-                    filelist, file, root=root if not absolute else None
-                ):
-                    continue
-            # Check file size
-            if size <= min_size:
+    path = str(path)
+    file_formats = frozenset(file_formats)
+    # Compile re patterns
+    if pattern:
+        pattern = re.compile(pattern)
+    if exclude_pattern:
+        exclude_pattern = re.compile(exclude_pattern)
+    # Match excludes by name and, as for "../dir", by absolute path
+    exclude_dirs = tuple(
+        {
+            form
+            for e_path in exclude_dirs or ()
+            for form in (normpath(e_path), os.path.abspath(e_path))
+        }
+    )
+    # Process found files; excluded directories are skipped while scanning
+    candidates = list()
+    for file, entry in scan_directory(
+        path,
+        file_formats,
+        recursive=recursive,
+        exclude_dirs=exclude_dirs,
+        verbose=verbose,
+    ):
+        # Check absolute file names
+        if absolute:
+            file = realpath(file)
+        # Check file size
+        stat = entry.stat()
+        if stat.st_size <= min_size:
+            continue
+        candidates.append((file, entry, stat))
+    # Check file match pattern, also into tags: read files in parallel
+    if pattern or exclude_pattern:
+        with ThreadPoolExecutor(max_workers) as executor:
+            matches = list(
+                executor.map(
+                    file_match,
+                    (file for file, _, _ in candidates),
+                    repeat(pattern),
+                    repeat(exclude_pattern),
+                    repeat(tags),
+                )
+            )
+        candidates = [c for c, match in zip(candidates, matches) if match]
+    for file, entry, stat in candidates:
+        # Check if file is in playlist
+        if unique and not file_is_unique(entry.path, seen, files_by_size, stat):
+            continue
+        if interactive:
+            if not confirm(file):
                 continue
-            if interactive:
-                if not confirm(file):
-                    continue
-            vprint(verbose, f"add multimedia file {file}")
-            filelist.append(unix_to_dos(file) if windows else file)
-    # Check sort
-    if sortby_name:
-        filelist = sorted(filelist)
-    elif sortby_date:
-        filelist = sorted(filelist, key=getctime)
-    elif sortby_track:
-        filelist = sorted(filelist, key=get_track)
-    elif sortby_year:
-        filelist = sorted(filelist, key=get_year)
-    elif sortby_size:
-        filelist = sorted(filelist, key=os.path.getsize)
-    elif sortby_length:
-        filelist = sorted(filelist, key=get_length)
+        vprint(verbose, f"add multimedia file {file}")
+        file = unix_to_dos(file) if windows else file
+        filelist.append(file)
+        stats[file] = stat
+    # Check sort, only if there is something to sort
+    if len(filelist) > 1:
+        if sortby_name:
+            filelist = sorted(filelist)
+        elif sortby_date:
+            filelist = sorted(filelist, key=lambda file: stats[file].st_ctime)
+        elif sortby_track:
+            filelist = sort_by_tag(filelist, partial(get_track, tags=tags), max_workers)
+        elif sortby_year:
+            filelist = sort_by_tag(filelist, partial(get_year, tags=tags), max_workers)
+        elif sortby_size:
+            filelist = sorted(filelist, key=lambda file: stats[file].st_size)
+        elif sortby_length:
+            filelist = sort_by_tag(
+                filelist, partial(get_length, tags=tags), max_workers
+            )
     return filelist
 
 
-def add_extension(filelist, cli_args, verbose=False):
-    """Add extension to playlist list"""
-    if not isinstance(filelist, list):
-        raise ValueError(f"{filelist} is not a list object")
+def add_extension(cli_args, verbose=False):
+    """Make extension lines of playlist
+
+    :param cli_args: command-line arguments
+    :param verbose: enable verbosity
+    :return: list of header lines
+    """
+    header = list()
 
     # Check if playlist is an extended M3U
-    cli_args.ext_part = 0
     if cli_args.title or cli_args.encoding or cli_args.image:
         if not cli_args.enabled_extensions:
-            filelist.insert(0, "#EXTM3U")
+            header.append("#EXTM3U")
             vprint(verbose, "enable extension flag")
             cli_args.enabled_extensions = True
-            cli_args.ext_part += 1
-            if cli_args.max_tracks:
-                cli_args.max_tracks += 1
+
+        # Set encoding
+        if cli_args.encoding:
+            if not cli_args.enabled_encoding:
+                header.append(f"#EXTENC: {cli_args.encoding}")
+                vprint(verbose, f"set encoding {cli_args.encoding}")
+            else:
+                print("warning: encoding is already configured")
 
         # Set title
         if cli_args.title:
             if not cli_args.enabled_title:
                 title = capwords(cli_args.title)
-                filelist.insert(1, f"#PLAYLIST: {title}")
+                header.append(f"#PLAYLIST: {title}")
                 vprint(verbose, f"set title {title}")
-                cli_args.ext_part += 1
-                if cli_args.max_tracks:
-                    cli_args.max_tracks += 1
             else:
                 print("warning: title is already configured")
 
-        # Set encoding
-        if cli_args.encoding:
-            if not cli_args.enabled_encoding:
-                filelist.insert(1, f"#EXTENC: {cli_args.encoding}")
-                vprint(verbose, f"set encoding {cli_args.encoding}")
-                cli_args.ext_part += 1
-                if cli_args.max_tracks:
-                    cli_args.max_tracks += 1
-            else:
-                print("warning: encoding is already configured")
+    return header
 
 
 def _process_playlist(files, cli_args, other_playlist=None):
@@ -713,14 +915,30 @@ def _process_playlist(files, cli_args, other_playlist=None):
     # Add other files
     files.extend(cli_args.file)
 
+    # Remove same files found in more directories or playlists
+    if cli_args.unique:
+        playlist = other_playlist if other_playlist else cli_args.playlist
+        # Skip also files already in the playlist to continue
+        existing = list()
+        if cli_args.append and isfile(playlist):
+            join_playlist(existing, playlist)
+        existing = set(existing)
+        files[:] = [file for file in dict.fromkeys(files) if file not in existing]
+
     # Build a playlist
     if files:
         # Check shuffle
         if cli_args.shuffle:
-            shuffle(files)
+            from random import sample, shuffle
+
+            # Pick only the tracks that will be written
+            if cli_args.max_tracks and cli_args.max_tracks < len(files):
+                files = sample(files, cli_args.max_tracks)
+            else:
+                shuffle(files)
 
         # Add extension to playlist
-        add_extension(files, cli_args, verbose=cli_args.verbose)
+        header = add_extension(cli_args, verbose=cli_args.verbose)
 
         # Write playlist to file
         write_playlist(
@@ -730,7 +948,7 @@ def _process_playlist(files, cli_args, other_playlist=None):
             encoding=cli_args.encoding,
             enabled_extensions=cli_args.enabled_extensions,
             image=cli_args.image,
-            ext_part=cli_args.ext_part,
+            header=header,
             max_tracks=cli_args.max_tracks,
             verbose=cli_args.verbose,
         )
@@ -749,12 +967,14 @@ def main():
         multimedia_files = list()
         vprint(
             args.verbose,
-            f"formats={FILE_FORMAT}, recursive={args.recursive}, "
+            f"formats={args.file_formats}, recursive={args.recursive}, "
             f"pattern={args.pattern}, split={args.split}",
         )
 
         # Define cache
         if args.cache:
+            from tempcache import TempCache
+
             cache = TempCache("mkpl", max_age=args.cache)
             vprint(args.verbose, f"use cache {cache.path}")
             # Clean the cache
@@ -762,59 +982,79 @@ def main():
         else:
             cache = None
 
-        # Make multimedia list
-        for directory in args.directories:
-            if args.cache:
-                directory_files = cache.cache_result(
-                    make_playlist,
-                    directory,
-                    FILE_FORMAT,
-                    args.pattern,
-                    args.exclude_pattern,
-                    sortby_name=args.orderby_name,
-                    sortby_date=args.orderby_date,
-                    sortby_track=args.orderby_track,
-                    sortby_year=args.orderby_year,
-                    sortby_size=args.orderby_size,
-                    sortby_length=args.orderby_length,
-                    recursive=args.recursive,
-                    exclude_dirs=args.exclude_dirs,
-                    unique=args.unique,
-                    absolute=args.absolute,
-                    min_size=args.size,
-                    windows=args.windows,
-                    interactive=args.interactive,
-                    verbose=args.verbose,
-                )
-            else:
-                directory_files = make_playlist(
-                    directory,
-                    FILE_FORMAT,
-                    args.pattern,
-                    args.exclude_pattern,
-                    sortby_name=args.orderby_name,
-                    sortby_date=args.orderby_date,
-                    sortby_track=args.orderby_track,
-                    sortby_year=args.orderby_year,
-                    sortby_size=args.orderby_size,
-                    sortby_length=args.orderby_length,
-                    recursive=args.recursive,
-                    exclude_dirs=args.exclude_dirs,
-                    unique=args.unique,
-                    absolute=args.absolute,
-                    min_size=args.size,
-                    windows=args.windows,
-                    interactive=args.interactive,
-                    verbose=args.verbose,
+        # Scan each directory once, in parallel except when asks for confirmation
+        directories = list(dict.fromkeys(args.directories))
+        parallel = len(directories) > 1 and not args.interactive
+        workers = min(32, len(directories)) if parallel else 1
+        # Share threads that read files between directories
+        max_workers = max(1, min(32, (os.cpu_count() or 1) + 4) // workers)
+
+        @wraps(make_playlist)
+        def make_shared_playlist(*arguments, **keywords):
+            """Make playlist list with the shared threads"""
+            return make_playlist(*arguments, max_workers=max_workers, **keywords)
+
+        # Make multimedia list: the same arguments are used for each directory;
+        # threads stay out of the cache key, as wraps keeps name and signature
+        if args.cache:
+            fn_make_playlist = partial(cache.cache_result, make_shared_playlist)
+        else:
+            fn_make_playlist = make_shared_playlist
+        make_directory_playlist = partial(
+            fn_make_playlist,
+            # Sorted formats keep the cache key equal across runs
+            file_formats=tuple(sorted(args.file_formats)),
+            pattern=args.pattern,
+            exclude_pattern=args.exclude_pattern,
+            sortby_name=args.orderby_name,
+            sortby_date=args.orderby_date,
+            sortby_track=args.orderby_track,
+            sortby_year=args.orderby_year,
+            sortby_size=args.orderby_size,
+            sortby_length=args.orderby_length,
+            recursive=args.recursive,
+            exclude_dirs=args.exclude_dirs,
+            unique=args.unique,
+            absolute=args.absolute,
+            min_size=args.size,
+            windows=args.windows,
+            interactive=args.interactive,
+            verbose=args.verbose,
+        )
+
+        if parallel:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                directories_files = list(
+                    executor.map(make_directory_playlist, directories)
                 )
+        else:
+            directories_files = map(make_directory_playlist, directories)
+        directories_files = dict(zip(directories, directories_files))
+
+        # Remove same files, or copies, found in more directories
+        if args.unique and len(directories) > 1:
+            seen, files_by_size = set(), dict()
+            for directory in directories:
+                directories_files[directory] = [
+                    file
+                    for file in directories_files[directory]
+                    if file_is_unique(
+                        unix_to_dos(file, viceversa=True) if args.windows else file,
+                        seen,
+                        files_by_size,
+                    )
+                ]
 
+        for directory in args.directories:
+            # Copy files, because processing playlist changes them
+            directory_files = list(directories_files[directory])
+            # Substitute chars with URL encoding, once for both playlists
+            if args.url_chars:
+                directory_files = url_chars(directory_files)
             multimedia_files.extend(directory_files)
 
             # Check if you must split into directory playlist
             if args.split:
-                # Substitute chars with URL encoding
-                if args.url_chars:
-                    multimedia_files = url_chars(directory_files)
                 playlist_name = basename(normpath(directory))
                 playlist_ext = ".m3u8" if args.encoding == "UNICODE" else ".m3u"
                 playlist_path = join(
@@ -823,10 +1063,6 @@ def main():
                 _process_playlist(directory_files, args, playlist_path)
                 args.enabled_extensions = False
 
-        # Substitute chars with URL encoding
-        if args.url_chars:
-            multimedia_files = url_chars(multimedia_files)
-
         _process_playlist(multimedia_files, args)
 
         # Count files into playlist